@@ -1,95 +1,253 @@
 import os
-import uuid
-from flask import Flask, request, jsonify, send_from_directory, redirect
+import re
+import pathlib
+import sys
+import queue
+import atexit
+import logging
+import logging.handlers
+import secrets
+import hashlib
+import functools
+from collections import OrderedDict
+import aiohttp
+import msgspec
+from cachetools import TTLCache
+from quart import Quart, Response, request
 from glide_sdk import GlideClient
-import asyncio
-from functools import wraps
+from glide_sdk.src.glide_sdk.services import magic_auth as glide_magic_auth
+from glide_sdk.src.glide_sdk.utils import FetchError, Response as FetchResponse, fetch_x as sdk_fetch_x
 
-# Helper function to run async code in sync Flask routes
-def async_route(f):
-    @wraps(f)
-    def wrapped(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
-    return wrapped
+# Use libuv's event loop where available (uvloop doesn't support Windows)
+if sys.platform != 'win32':
+    import uvloop
+    uvloop.install()
+
+# Log records are queued by request handlers and written by a background thread
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.setLevel(logging.INFO)
+logger.propagate = False
 
 def get_client_ip():
     """Get the client's IP address from the request.
     Handles X-Forwarded-For header for proxy cases.
     Returns the first IP in the chain (original client)."""
-    ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-    if ip and ',' in ip:
-        # If multiple IPs in X-Forwarded-For, take the first one (original client)
-        ip = ip.split(',')[0].strip()
-    return ip
-
-app = Flask(__name__, 
-    static_folder=os.path.join(os.path.dirname(__file__), 'static'),
+    ip = request.headers.get('X-Forwarded-For') or request.remote_addr
+    # partition returns the whole string when there is no comma, so no check is needed
+    return ip.partition(',')[0].strip() if ip else ip
+
+PHONE_RE = re.compile(r'^\+?[1-9][0-9]{6,14}$')
+# Longest input worth looking at: an E.164 number is at most 16 characters
+MAX_PHONE_INPUT_LENGTH = 32
+
+def normalize_phone(phone_number):
+    """Return the phone number in E.164 form, or None if it isn't a valid number"""
+    # Checked before the cached lookup, which can only hash strings and
+    # shouldn't hold on to arbitrarily large request values
+    if not isinstance(phone_number, str) or len(phone_number) > MAX_PHONE_INPUT_LENGTH:
+        return None
+    return normalize_phone_str(phone_number)
+
+@functools.lru_cache(maxsize=65536)
+def normalize_phone_str(phone_number):
+    phone_number = phone_number.strip()
+    if not PHONE_RE.match(phone_number):
+        return None
+    return phone_number if phone_number.startswith('+') else f'+{phone_number}'
+
+json_encoder = msgspec.json.Encoder()
+
+def json_response(data, status=200):
+    """Serialize a dict or response struct and wrap it in a JSON response"""
+    return Response(json_encoder.encode(data), status=status, mimetype='application/json')
+
+# Response bodies for the verification endpoints
+class StartResponse(msgspec.Struct):
+    type: str
+    authUrl: str
+    flatAuthUrl: str
+    operatorId: str
+    state: str
+
+class CheckResponse(msgspec.Struct):
+    verified: bool
+
+# check-verification only ever returns one of these two bodies, so encode them once
+VERIFIED_BODY = json_encoder.encode(CheckResponse(verified=True))
+NOT_VERIFIED_BODY = json_encoder.encode(CheckResponse(verified=False))
+
+# Stored in state_cache for each auth flow
+class Session(msgspec.Struct):
+    phone_number: str
+    device_ip_address: str
+    status: str = 'pending'
+    error: str | None = None
+
+class SessionCache(TTLCache):
+    """TTLCache that evicts finished sessions before pending ones when full"""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        # Keys of sessions no request will read again, oldest first
+        self.terminal = OrderedDict()
+
+    def mark_terminal(self, key):
+        """Make the session the first candidate for eviction"""
+        self.terminal[key] = None
+
+    def popitem(self):
+        while self.terminal:
+            key, _ = self.terminal.popitem(last=False)
+            if key in self:
+                return (key, self.pop(key))
+        return super().popitem()
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for key, _ in expired:
+            self.terminal.pop(key, None)
+        return expired
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.terminal.pop(key, None)
+
+STATIC_DIR = pathlib.Path(__file__).parent / 'static'
+INDEX_PATH = STATIC_DIR / 'index.html'
+
+app = Quart(__name__, 
+    static_folder=STATIC_DIR,
     static_url_path=''
 )
+# Quart already streams static files in chunks; let browsers cache them like index.html
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 60
+
+# index.html is read once at startup and served from memory
+INDEX_BYTES = INDEX_PATH.read_bytes()
+INDEX_ETAG = f'"{hashlib.md5(INDEX_BYTES).hexdigest()}"'
+
+def index_response():
+    """Return the cached index.html, or a 304 if the client already has it"""
+    headers = {'ETag': INDEX_ETAG, 'Cache-Control': 'public, max-age=60'}
+    if request.headers.get('If-None-Match') == INDEX_ETAG:
+        return Response(b'', status=304, headers=headers)
+    return Response(INDEX_BYTES, mimetype='text/html', headers=headers)
+
+# Configuration
+PORT = int(os.getenv('PORT', 8080))
+SESSION_TTL = int(os.getenv('SESSION_TTL', 900))
+MAGIC_REDIRECT_URI = os.getenv('MAGIC_REDIRECT_URI', f'http://localhost:{PORT}/')
 
 # Global variables to store session data
-state_cache = {}
+# Sessions expire after SESSION_TTL seconds so abandoned auth flows don't pile up
+# When full, verified/failed/errored sessions are evicted before pending ones
+state_cache = SessionCache(maxsize=100_000, ttl=SESSION_TTL)
+# Re-inserted on every new session, so an entry lives as long as its newest session
+phone_to_sessions = TTLCache(maxsize=100_000, ttl=SESSION_TTL)
 current_session = None
 
 # Initialize Glide client
 glide_client = GlideClient()
 
-# Configuration
-PORT = int(os.getenv('PORT', 8080))
+# glide_sdk opens a new aiohttp session (and TLS connection) for every API call.
+# Route magic auth calls through one pooled session that keeps connections alive.
+http_session = None
+
+async def pooled_fetch_x(url, input):
+    """Drop-in replacement for glide_sdk's fetch_x using the shared session"""
+    if http_session is None:
+        return await sdk_fetch_x(url, input)
+    async with http_session.request(
+        method=input.method,
+        url=url,
+        headers=input.headers,
+        data=input.body
+    ) as response:
+        data = await response.text()
+
+        if response.status >= 400:
+            raise FetchError(response.status, response.reason, data)
+
+        return FetchResponse(data, response.status, response.status < 400)
+
+@app.before_serving
+async def open_http_session():
+    global http_session
+    http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=50))
+    glide_magic_auth.fetch_x = pooled_fetch_x
+
+@app.after_serving
+async def close_http_session():
+    global http_session
+    glide_magic_auth.fetch_x = sdk_fetch_x
+    await http_session.close()
+    http_session = None
+
+async def update_session_status(phone_number, verified):
+    """Mark every cached session for the phone number as verified or failed"""
+    for session_id in phone_to_sessions.get(phone_number, ()):
+        session = state_cache.get(session_id)
+        if session is not None:
+            session.status = 'verified' if verified else 'failed'
+            state_cache.mark_terminal(session_id)
 
 @app.route('/')
-def home():
+async def home():
     """Serve the main HTML page"""
-    return send_from_directory(app.static_folder, 'index.html')
+    return index_response()
 
 @app.route('/api/start-verification', methods=['POST'])
-@async_route
 async def start_verification():
     """Start the magic auth verification process"""
     try:
-        phone_number = request.json.get('phoneNumber')
+        phone_number = normalize_phone(msgspec.json.decode(await request.get_data()).get('phoneNumber'))
+        if not phone_number:
+            return json_response({'error': 'Invalid phone number'}, 400)
         device_ip_address = get_client_ip()
-        print(f'Start Auth for {phone_number} from IP {device_ip_address}')
+        logger.info('Start Auth for %s from IP %s', phone_number, device_ip_address)
         
-        session_id = str(uuid.uuid4())
-        state_cache[session_id] = {
-            'phoneNumber': phone_number,
-            'status': 'pending',
-            'deviceIpAddress': device_ip_address
-        }
+        session_id = secrets.token_urlsafe(16)
+        state_cache[session_id] = Session(phone_number, device_ip_address)
+        # Drop IDs whose sessions have expired so a busy number's set stays small
+        phone_to_sessions[phone_number] = {
+            sid for sid in phone_to_sessions.get(phone_number, ()) if sid in state_cache
+        } | {session_id}
         
         auth_res = await glide_client.magic_auth.start_auth(
             phone_number=phone_number,
             state=session_id,
-            redirect_url=os.getenv('MAGIC_REDIRECT_URI', f'http://localhost:{PORT}/'),
+            redirect_url=MAGIC_REDIRECT_URI,
             fallback_channel='NO_FALLBACK',
             device_ip_address=device_ip_address
         )
         
-        # Convert the response object to a dictionary with correct fields
-        response_dict = {
-            'type': auth_res.type,
-            'authUrl': auth_res.authUrl,
-            'flatAuthUrl': auth_res.flatAuthUrl,
-            'operatorId': auth_res.operatorId,
-            'state': session_id
-        }
-        
-        return jsonify(response_dict)
+        return json_response(StartResponse(
+            type=auth_res.type,
+            authUrl=auth_res.authUrl,
+            flatAuthUrl=auth_res.flatAuthUrl,
+            operatorId=auth_res.operatorId,
+            state=session_id
+        ))
     except Exception as error:
-        print(f'Error: {error}')
-        return jsonify({'error': str(error)}), 400
+        logger.error('Error: %s', error)
+        return json_response({'error': str(error)}, 400)
 
 @app.route('/api/check-verification', methods=['POST'])
-@async_route
 async def check_verification():
     """Verify the magic auth token"""
     try:
-        data = request.json
-        phone_number = data.get('phoneNumber')
+        data = msgspec.json.decode(await request.get_data())
+        phone_number = normalize_phone(data.get('phoneNumber'))
+        if not phone_number:
+            return json_response({'error': 'Invalid phone number'}, 400)
         token = data.get('token')
         device_ip_address = get_client_ip()
-        print(f'Check Auth for {phone_number} from IP {device_ip_address}')
+        logger.info('Check Auth for %s from IP %s', phone_number, device_ip_address)
         
         check_res = await glide_client.magic_auth.verify_auth(
             phone_number=phone_number,
@@ -97,61 +255,56 @@ async def check_verification():
             device_ip_address=device_ip_address
         )
         
-        # Update session status if verification successful
-        for session_id, session in state_cache.items():
-            if session['phoneNumber'] == phone_number:
-                session['status'] = 'verified' if check_res.verified else 'failed'
-                break
-        
-        # Convert the response object to a dictionary with correct field
-        response_dict = {
-            'verified': check_res.verified
-        }
+        # The response doesn't depend on the session update, so do it after replying
+        app.add_background_task(update_session_status, phone_number, check_res.verified)
         
-        return jsonify(response_dict)
+        body = VERIFIED_BODY if check_res.verified else NOT_VERIFIED_BODY
+        return Response(body, mimetype='application/json')
     except Exception as error:
-        print(f'Error: {error}')
-        return jsonify({'error': str(error)}), 400
+        logger.error('Error: %s', error)
+        return json_response({'error': str(error)}, 400)
 
 @app.route('/api/get-session', methods=['POST'])
-def get_session():
+async def get_session():
     """Retrieve session information"""
     try:
-        state = request.json.get('state')
-        print('Get Session')
+        state = msgspec.json.decode(await request.get_data()).get('state')
+        logger.info('Get Session')
         
-        if state not in state_cache:
-            return jsonify({'error': 'Session not found'}), 404
+        session_data = state_cache.get(state)
+        if session_data is None:
+            return json_response({'error': 'Session not found'}, 404)
             
-        session_data = state_cache[state]
-        return jsonify({
-            'phoneNumber': session_data['phoneNumber'],
-            'status': session_data['status']
+        return json_response({
+            'phoneNumber': session_data.phone_number,
+            'status': session_data.status
         })
     except Exception as error:
-        print(f'Error: {error}')
-        return jsonify({'error': str(error)}), 400
+        logger.error('Error: %s', error)
+        return json_response({'error': str(error)}, 400)
 
 @app.route('/callback')
-def callback():
+async def callback():
     """Handle the callback from magic auth verification"""
     try:
         state = request.args.get('state')
         error = request.args.get('error')
         
-        if state not in state_cache:
-            return jsonify({'error': 'Invalid state parameter'}), 400
+        session_data = state_cache.get(state)
+        if session_data is None:
+            return json_response({'error': 'Invalid state parameter'}, 400)
             
         if error:
-            state_cache[state]['status'] = 'error'
-            state_cache[state]['error'] = error
+            session_data.status = 'error'
+            state_cache.mark_terminal(state)
+            session_data.error = error
         else:
-            state_cache[state]['status'] = 'callback_received'
+            session_data.status = 'callback_received'
             
-        return send_from_directory(app.static_folder, 'index.html')
+        return index_response()
     except Exception as error:
-        print(f'Error: {error}')
-        return jsonify({'error': str(error)}), 400
+        logger.error('Error: %s', error)
+        return json_response({'error': str(error)}, 400)
 
 if __name__ == '__main__':
     # Only for local development